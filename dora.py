@@ -26,8 +26,8 @@ def main():
 
     # Initialize session states
     if "events_df" not in st.session_state:
-        st.session_state["events_df"] = pd.DataFrame(columns=["event_title", "place", "starting_time",
-                                                              "finishing_time"])
+        st.session_state["events_df"] = compact_events(pd.DataFrame(columns=["event_title", "place", "starting_time",
+                                                                             "finishing_time"]))
 
     if "event_inputs" not in st.session_state:
         st.session_state["event_inputs"] = {
@@ -60,7 +60,7 @@ def main():
             "starting_time": starting_datetime,
             "finishing_time": finishing_datetime
         }
-        st.session_state["events_df"] = pd.concat([st.session_state["events_df"], pd.DataFrame([new_event])], ignore_index=True)
+        st.session_state["events_df"] = compact_events(pd.concat([st.session_state["events_df"], pd.DataFrame([new_event])], ignore_index=True))
         st.sidebar.success("Event added successfully!")
 
         # Reset input fields
@@ -87,12 +87,12 @@ def main():
 
         if st.sidebar.button("Delete Selected Event"):
             st.session_state["events_df"].drop(index=event_to_delete, inplace=True)
-            st.session_state["events_df"].reset_index(drop=True, inplace=True)
+            st.session_state["events_df"] = compact_events(st.session_state["events_df"].reset_index(drop=True))
             st.success("Event deleted successfully!")
 
     
         if st.sidebar.button("Delete All Events"):
-            st.session_state["events_df"] = pd.DataFrame(columns=["event_title", "place", "starting_time", "finishing_time"])
+            st.session_state["events_df"] = compact_events(pd.DataFrame(columns=["event_title", "place", "starting_time", "finishing_time"]))
             st.success("All events deleted successfully!")
             
     # Initialize session states
@@ -263,12 +263,15 @@ def main():
             if st.session_state["events_df"].empty:
                 st.warning("No events to display on the timeline.")
             else: # st.session_state["dot_color"], st.session_state["dot_size"]
-                timeline_obj = event_timeline(st.session_state["events_df"], st.session_state["bar_color"], st.session_state["bar_width"],
+                # Expand recurring events over the default window, like main.py
+                events_df = expand_recurring_events(st.session_state["events_df"])
+                timeline_obj = event_timeline(events_df, st.session_state["bar_color"], st.session_state["bar_width"],
                                 st.session_state["opacity"], st.session_state["visualize"], st.session_state["height"],
                                 st.session_state["width"], st.session_state["background_color"], st.session_state["background_image"], st.session_state["background_image_opacity"],
                                 st.session_state["grid_width"], st.session_state["grid_color"],
                                 st.session_state["letter_color"],st.session_state["event_letter_size"], 
-                                st.session_state["time_letter_size"], st.session_state["letter_style"])
+                                st.session_state["time_letter_size"], st.session_state["letter_style"],
+                                render_mode="svg")
                 buf = io.BytesIO()
                 timeline_obj.write_image(buf, format="png")
                 buf.seek(0)
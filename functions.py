@@ -1,27 +1,153 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 import io
+import os
 import base64
+import time
+
+# Compact dtypes for the events DataFrame kept in the session
+EVENT_DTYPES = {
+    "event_title": "category",
+    "place": "category",
+    "starting_time": "datetime64[ns]",
+    "finishing_time": "datetime64[ns]",
+    "repeat": "category",
+    "repeat_until": "datetime64[ns]",
+}
+
+# Export formats offered by the download button: label -> (file extension, mime type)
+EXPORT_FORMATS = {
+    "PNG": ("png", "image/png"),
+    "WebP": ("webp", "image/webp"),
+    "JPEG": ("jpg", "image/jpeg"),
+}
+
+# Recurrence rules that can be stored on an event: label -> repeat period
+REPEAT_PERIODS = {
+    "Daily": np.timedelta64(1, "D"),
+    "Weekly": np.timedelta64(7, "D"),
+}
+
+# Length of the window recurring events are expanded over when no custom window is chosen
+DEFAULT_WINDOW = np.timedelta64(7, "D")
+
+# Above this many events event_timeline switches from SVG bars to WebGL traces
+WEBGL_THRESHOLD = 5000
+
+# Worker threads for export encoding, shared by every session of the server process. Each
+# rerun still waits for its own encode, so a session only gains the overlap with building the
+# mockup; the pool is sized to the CPU count so that concurrent sessions' encodes, which
+# release the GIL inside Pillow, run in parallel instead of queueing behind each other.
+_encode_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="export-encode")
 
 def encode_image(image_file):
     """Convert image file to base64 string."""
     encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
     return f"data:image/png;base64,{encoded_image}"
 
+def compact_events(df_):
+    """
+    Casts the events DataFrame to EVENT_DTYPES.
+
+    Titles, places and repeat rules become categoricals and times become datetime64, which is
+    far smaller than the object columns built from the input widgets.
+    """
+    df_ = df_.astype({column: dtype for column, dtype in EVENT_DTYPES.items() if column in df_.columns})
+    for column in df_.select_dtypes("category").columns:
+        df_[column] = df_[column].cat.remove_unused_categories()
+    return df_
+
+def expand_recurring_events(df_, window_start=None, window_end=None):
+    """
+    Expands recurring events into their occurrences inside the rendered time window.
+
+    Events carry their recurrence rule in the "repeat" (a key of REPEAT_PERIODS or "None")
+    and "repeat_until" (last allowed start, or empty for open-ended series) columns. Only the
+    occurrences overlapping the window are generated, with NumPy datetime64 arithmetic, so
+    long-running series are never fully materialized.
+
+    :param df_: Events DataFrame as stored in the session.
+    :param window_start: Start of the rendered window. Defaults to the earliest one-off event
+        start (or today when there are only recurring events), moved forward to the first
+        series start if that is later.
+    :param window_end: End of the rendered window. Defaults to DEFAULT_WINDOW after its start,
+        or the last one-off event finish if that is later.
+    :return: DataFrame with one row per event occurrence in the window. Without a custom window
+        all one-off events are kept, since they are already materialized.
+    """
+    if "repeat" not in df_.columns or df_.empty:
+        return df_
+
+    # Work on int64 nanoseconds so the arithmetic stays vectorized
+    starts = pd.to_datetime(df_["starting_time"]).to_numpy("datetime64[ns]").astype(np.int64)
+    finishes = pd.to_datetime(df_["finishing_time"]).to_numpy("datetime64[ns]").astype(np.int64)
+    durations = finishes - starts
+    period_ns = {label: int(period / np.timedelta64(1, "ns")) for label, period in REPEAT_PERIODS.items()}
+    periods = df_["repeat"].astype(str).map(period_ns).fillna(0).to_numpy(np.int64)
+    untils = pd.to_datetime(df_["repeat_until"]).to_numpy("datetime64[ns]")
+    untils = np.where(np.isnat(untils), np.iinfo(np.int64).max, untils.astype(np.int64))
+    recurring = periods > 0
+
+    # The default window never reaches back to where a series began, so it stays bounded, but
+    # it starts no earlier than the first series and lasts until the last one-off event ends
+    if window_start is not None:
+        w0 = pd.Timestamp(window_start).value
+    else:
+        w0 = starts[~recurring].min() if (~recurring).any() else pd.Timestamp.now().normalize().value
+        if recurring.any():
+            w0 = max(w0, starts[recurring].min())
+    if window_end is not None:
+        w1 = pd.Timestamp(window_end).value
+    else:
+        w1 = w0 + int(DEFAULT_WINDOW / np.timedelta64(1, "ns"))
+        if window_start is None and (~recurring).any():
+            w1 = max(w1, finishes[~recurring].max())
+
+    # One-off events are kept when they overlap a custom window
+    one_off = ~recurring
+    if window_start is not None or window_end is not None:
+        one_off &= (finishes >= w0) & (starts <= w1)
+
+    # Occurrence k of a series starts at start + k * period; keep the k that overlap the window
+    rec = np.flatnonzero(recurring)
+    p, s, d = periods[rec], starts[rec], durations[rec]
+    k_first = np.maximum(0, -((s + d - w0) // p))
+    k_last = (np.minimum(w1, untils[rec]) - s) // p
+    counts = np.clip(k_last - k_first + 1, 0, None)
+    rows = np.repeat(rec, counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(k_first, counts)
+    occurrence_starts = starts[rows] + k * periods[rows]
+
+    columns = ["event_title", "place", "starting_time", "finishing_time"]
+    occurrences = df_.iloc[rows][["event_title", "place"]].assign(
+        starting_time=occurrence_starts.astype("datetime64[ns]"),
+        finishing_time=(occurrence_starts + durations[rows]).astype("datetime64[ns]"),
+    )
+    one_offs = df_.loc[one_off, columns].assign(
+        starting_time=starts[one_off].astype("datetime64[ns]"),
+        finishing_time=finishes[one_off].astype("datetime64[ns]"),
+    )
+    return pd.concat([one_offs, occurrences], ignore_index=True)
+
 def event_timeline(df_,bar_color=None, bar_width=1, opacity=1-0, 
                    visualize="place", height=300, width=900, background_color=None, 
                    background_image=None, background_image_opacity=0.5,
                    grid_width=0.1, grid_color="rgba(0,0,0,0)",letter_color="#BBBBBB", 
-                   event_letter_size=25, time_letter_size=15, letter_style="Lato, sans-serif"): # dot_color, dot_size,
+                   event_letter_size=25, time_letter_size=15, letter_style="Lato, sans-serif",
+                   render_mode="auto", webgl_threshold=WEBGL_THRESHOLD): # dot_color, dot_size,
     """
     Generates a timeline visualization for events over a 3-day period.
 
     Args:
     df_ (DataFrame): The input data containing event details.
+    render_mode (str): "svg" for px.timeline bars, "webgl" for WebGL traces, or "auto" to
+        use WebGL once the number of events exceeds webgl_threshold.
 
     Returns:
     None: Displays the timeline chart in the Streamlit app.
@@ -32,26 +158,33 @@ def event_timeline(df_,bar_color=None, bar_width=1, opacity=1-0,
         color_sequence = [bar_color]  # Use the single color for all bars
     else:
         color_sequence = None  # Use dynamic coloring based on the 'place' column
-    # Create a timeline visualization    
-    fig_timeline = px.timeline(
-        data_frame=df_,
-        x_start="starting_time",
-        x_end="finishing_time",
-        y=visualize,
-        color="event_title" if visualize == "place" else "place",
-        template="plotly_dark",
-        width= width,
-        height= height,
-        color_discrete_sequence= color_sequence
-        
-    )
+    if render_mode == "auto":
+        render_mode = "webgl" if len(df_) > webgl_threshold else "svg"
 
-    fig_timeline.update_traces(
-        marker=dict(line=dict(width=grid_width, color=grid_color)),
-        # selector=dict(mode="markers+lines"),# other options: "markers", "lines" or "markers+lines"  
-        width = bar_width, opacity=opacity
-        
-    )
+    if render_mode == "webgl":
+        fig_timeline = _webgl_timeline(df_, visualize, color_sequence, bar_width, opacity,
+                                       grid_width, grid_color, height, width, event_letter_size)
+    else:
+        # Create a timeline visualization    
+        fig_timeline = px.timeline(
+            data_frame=df_,
+            x_start="starting_time",
+            x_end="finishing_time",
+            y=visualize,
+            color="event_title" if visualize == "place" else "place",
+            template="plotly_dark",
+            width= width,
+            height= height,
+            color_discrete_sequence= color_sequence
+            
+        )
+
+        fig_timeline.update_traces(
+            marker=dict(line=dict(width=grid_width, color=grid_color)),
+            # selector=dict(mode="markers+lines"),# other options: "markers", "lines" or "markers+lines"  
+            width = bar_width, opacity=opacity
+            
+        )
     
     # Style gridlines and text
     fig_timeline.update_layout(
@@ -116,11 +249,15 @@ def event_timeline(df_,bar_color=None, bar_width=1, opacity=1-0,
         )
 
 
-    fig_timeline.update_yaxes(
-        title_text='', 
-        showgrid=True, 
-        categoryorder="total ascending"
-    )
+    if render_mode != "webgl":  # the WebGL layout already orders its categories
+        fig_timeline.update_yaxes(
+            title_text='', 
+            showgrid=True, 
+            categoryorder="total ascending"
+        )
+    else:
+        # On the numeric WebGL axis the zero line would cut through the bottom category
+        fig_timeline.update_yaxes(zeroline=False)
     fig_timeline.update_xaxes(
         title_text='', 
         showgrid=True
@@ -128,6 +265,99 @@ def event_timeline(df_,bar_color=None, bar_width=1, opacity=1-0,
 
     return fig_timeline
     
+def _webgl_timeline(df_, visualize, color_sequence, bar_width, opacity,
+                    grid_width, grid_color, height, width, event_letter_size):
+    """
+    Builds the timeline from WebGL (scattergl) traces instead of SVG bars.
+
+    Every event becomes a filled rectangle in one scattergl trace per color group, so the
+    browser draws thousands of bars on the GPU. Categories are laid out like px.timeline
+    with categoryorder="total ascending": lowest total duration at the bottom.
+    """
+    color = "event_title" if visualize == "place" else "place"
+    starts = pd.to_datetime(df_["starting_time"]).to_numpy("datetime64[ms]").astype(np.int64)
+    finishes = pd.to_datetime(df_["finishing_time"]).to_numpy("datetime64[ms]").astype(np.int64)
+
+    # Category positions on a numeric y axis, labelled through tick text
+    totals = pd.Series(finishes - starts, index=df_.index).groupby(df_[visualize].to_numpy(), sort=False).sum()
+    categories = totals.sort_values(kind="stable").index
+    positions = pd.Series(np.arange(len(categories)), index=categories)
+    y_centers = positions.loc[df_[visualize].to_numpy()].to_numpy(np.float64)
+
+    # Rectangle corners per event, closed and followed by a gap so each bar fills on its own
+    half = bar_width / 2
+    x = np.column_stack([starts, finishes, finishes, starts, starts, np.full(len(df_), np.nan)])
+    y = np.column_stack([y_centers - half, y_centers - half, y_centers + half, y_centers + half,
+                         y_centers - half, np.full(len(df_), np.nan)])
+
+    # Hover details per event, laid out like the px.timeline hover labels
+    centers = (starts + finishes) / 2
+    hover_data = np.column_stack([
+        df_[color].astype(str).to_numpy(),
+        pd.to_datetime(df_["starting_time"]).astype(str).to_numpy(),
+        pd.to_datetime(df_["finishing_time"]).astype(str).to_numpy(),
+        df_[visualize].astype(str).to_numpy(),
+    ])
+    hover_template = (f"{color}=%{{customdata[0]}}<br>starting_time=%{{customdata[1]}}<br>"
+                      f"finishing_time=%{{customdata[2]}}<br>{visualize}=%{{customdata[3]}}<extra></extra>")
+
+    colors = color_sequence or px.colors.qualitative.Plotly
+    fig_timeline = go.Figure(layout=dict(template="plotly_dark", width=width, height=height))
+    for i, (name, group) in enumerate(df_.groupby(color, sort=False, observed=True).indices.items()):
+        fig_timeline.add_trace(go.Scattergl(
+            x=x[group].ravel(),
+            y=y[group].ravel(),
+            mode="lines",
+            fill="toself",
+            fillcolor=colors[i % len(colors)],
+            line=dict(width=grid_width, color=grid_color),
+            opacity=opacity,
+            name=str(name),
+            legendgroup=str(name),
+            showlegend=False,
+            hoverinfo="skip",
+        ))
+        # scattergl only hovers on vertices, so an invisible marker at each bar centre carries
+        # the same hover details as the px.timeline bars
+        fig_timeline.add_trace(go.Scattergl(
+            x=centers[group],
+            y=y_centers[group],
+            mode="markers",
+            marker=dict(color="rgba(0,0,0,0)"),
+            customdata=hover_data[group],
+            hovertemplate=hover_template,
+            name=str(name),
+            legendgroup=str(name),
+            showlegend=False,
+        ))
+        # Empty marker trace so the legend shows a square swatch like the SVG bars
+        fig_timeline.add_trace(go.Scattergl(
+            x=[None],
+            y=[None],
+            mode="markers",
+            marker=dict(symbol="square", size=12, color=colors[i % len(colors)]),
+            opacity=opacity,
+            name=str(name),
+            legendgroup=str(name),
+        ))
+
+    # Thin out the category labels when they wouldn't fit, as a category axis does. The plot
+    # area is the figure height minus plotly's default top and bottom margins (100 + 80 px),
+    # and each label takes about 1.2 times its font size, the usual line height
+    fitting_labels = max(1, int((height - 180) / (event_letter_size * 1.2)))
+    label_step = -(-len(categories) // fitting_labels)
+
+    fig_timeline.update_xaxes(type="date")
+    fig_timeline.update_yaxes(
+        title_text='',
+        showgrid=True,
+        tickmode="array",
+        tickvals=positions.to_numpy()[::label_step],
+        ticktext=[str(category) for category in categories[::label_step]],
+        range=[-0.5, len(categories) - 0.5],
+    )
+    return fig_timeline
+
 def simulate_instagram_display(fig_timeline_or_image, mockup_type="story",new_width=1050, new_height=800):
     """
     Simulates how a figure or image will look in Instagram's mobile app story or post view.
@@ -178,3 +408,52 @@ def simulate_instagram_display(fig_timeline_or_image, mockup_type="story",new_wi
 
     return mockup
 
+def encode_export(image, export_format="PNG", compression_level=6, quality=85, palette_colors=0, lossless=False):
+    """
+    Encodes a rendered timeline image for download.
+
+    :param image: PIL Image to encode.
+    :param export_format: One of the keys of EXPORT_FORMATS.
+    :param compression_level: 0 (fastest) to 9 (smallest). Used as the zlib level for PNG
+        and mapped onto the 0-6 encoder effort for WebP. JPEG is always Huffman-optimized.
+    :param quality: Lossy quality (1-100) for WebP and JPEG.
+    :param palette_colors: Quantize to this many colors before encoding (0 disables it).
+        Timelines are mostly flat colors, so a small palette shrinks the file a lot.
+        Ignored for JPEG, which has no palettes.
+    :param lossless: Encode WebP losslessly, which keeps flat-color charts free of artifacts.
+    :return: Tuple of (encoded bytes, encode time in seconds).
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export_format. Choose one of {', '.join(EXPORT_FORMATS)}.")
+
+    start = time.perf_counter()
+
+    if palette_colors and export_format != "JPEG":
+        # Fast octree is the only quantizer that also handles RGBA images
+        image = image.quantize(colors=palette_colors, method=Image.Quantize.FASTOCTREE)
+
+    buf = io.BytesIO()
+    if export_format == "PNG":
+        image.save(buf, format="PNG", compress_level=compression_level)
+    elif export_format == "WebP":
+        if image.mode == "P":
+            image = image.convert("RGBA")
+        if lossless:
+            # For lossless WebP, quality is the compression effort rather than fidelity
+            image.save(buf, format="WEBP", lossless=True, quality=round(compression_level * 100 / 9),
+                       method=round(compression_level * 6 / 9))
+        else:
+            image.save(buf, format="WEBP", quality=quality, method=round(compression_level * 6 / 9))
+    else:
+        # JPEG has no alpha
+        image.convert("RGB").save(buf, format="JPEG", quality=quality, optimize=True)
+
+    return buf.getvalue(), time.perf_counter() - start
+
+def encode_export_async(image, **kwargs):
+    """
+    Submits encode_export to the export worker threads.
+
+    :return: Future resolving to the (encoded bytes, encode time in seconds) tuple.
+    """
+    return _encode_executor.submit(encode_export, image, **kwargs)
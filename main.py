@@ -1,15 +1,15 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, time
 from PIL import Image
-from functions import encode_image, event_timeline, simulate_instagram_display
+from functions import encode_image, compact_events, event_timeline, simulate_instagram_display, encode_export_async, EXPORT_FORMATS, expand_recurring_events, REPEAT_PERIODS, WEBGL_THRESHOLD
 import io
 from matplotlib.colors import to_rgba
 
 def initialize_session_states():
     """Initializes Streamlit session states."""
     default_states = {
-        "events_df": pd.DataFrame(columns=["event_title", "place", "starting_time", "finishing_time"]),
+        "events_df": compact_events(pd.DataFrame(columns=["event_title", "place", "starting_time", "finishing_time", "repeat", "repeat_until"])),
         "event_inputs": {
             "event_title": "",
             "place": "",
@@ -17,6 +17,8 @@ def initialize_session_states():
             "starting_time": datetime.now().time(),
             "finishing_date": datetime.now().date(),
             "finishing_time": datetime.now().time(),
+            "repeat": "None",
+            "repeat_until": None,
         },
         "bar_color": "#8FA2B7",
         "opacity": 0.65,
@@ -25,6 +27,7 @@ def initialize_session_states():
         "width": 1050,
         "background_color": '#DAE1E4',
         "background_image": None,
+        "background_file_id": None,
         "background_image_opacity": 0.5,
         "grid_width": 1.2,
         "grid_color": "black",
@@ -32,7 +35,16 @@ def initialize_session_states():
         "time_letter_size": 25,
         "event_letter_size": 40,
         "letter_style": "Lato, sans-serif",
-        "visualize": "event_title"
+        "visualize": "event_title",
+        "window_start": None,
+        "window_end": None,
+        "webgl_threshold": WEBGL_THRESHOLD,
+        "interactive_preview": False,
+        "export_format": "PNG",
+        "compression_level": 6,
+        "export_quality": 85,
+        "palette_colors": 0,
+        "export_lossless": False
     }
     for key, value in default_states.items():
         if key not in st.session_state:
@@ -41,7 +53,7 @@ def initialize_session_states():
 def render_styling_options():
     """Renders the styling options for the timeline."""
     with st.expander("Styling Options", expanded=False):
-        options = st.selectbox("Select a Styling Option", ["Bars", "Letters", "Grid", "Background", "Timeline Size"])
+        options = st.selectbox("Select a Styling Option", ["Bars", "Letters", "Grid", "Background", "Timeline Size", "Timeline Window", "Rendering"])
 
         if options == "Bars":
             color_options = st.selectbox("Select a color option", ["Single Color", "Color Palette"])
@@ -81,8 +93,10 @@ def render_styling_options():
             elif bg_option == "Image":
                 uploaded_image = st.file_uploader("Upload a background image", type=["jpg", "jpeg", "png"])
                 if uploaded_image is not None:
-                    background_image = encode_image(uploaded_image)
-                    st.session_state["background_image"] = background_image
+                    # Keep the raw upload once per file; the base64 data URI is only built for rendering
+                    if uploaded_image.file_id != st.session_state["background_file_id"]:
+                        st.session_state["background_image"] = uploaded_image.getvalue()
+                        st.session_state["background_file_id"] = uploaded_image.file_id
                     st.session_state["background_image_opacity"] = st.slider("Background Image Opacity", 0.0, 1.0, st.session_state["background_image_opacity"])
 
         elif options == "Timeline Size":
@@ -91,10 +105,50 @@ def render_styling_options():
             width = st.slider("Width", 100, 2000, st.session_state["width"])
             st.session_state["width"] = width
 
+        elif options == "Timeline Window":
+            custom_window = st.checkbox("Custom time window", value=st.session_state["window_start"] is not None)
+            if custom_window:
+                window_start = st.date_input("Window start", value=st.session_state["window_start"] or datetime.now().date())
+                window_end = st.date_input("Window end", value=st.session_state["window_end"] or window_start)
+                st.session_state["window_start"] = window_start
+                st.session_state["window_end"] = window_end
+            else:
+                st.session_state["window_start"] = None
+                st.session_state["window_end"] = None
+
+        elif options == "Rendering":
+            interactive_preview = st.checkbox("Interactive preview", value=st.session_state["interactive_preview"])
+            st.session_state["interactive_preview"] = interactive_preview
+            webgl_threshold = st.number_input("Use WebGL in the preview above this many events", 0, 1_000_000, st.session_state["webgl_threshold"], step=1000)
+            st.session_state["webgl_threshold"] = webgl_threshold
+
         if st.button("Reset All Styling Options"):
             initialize_session_states()
             st.success("Styling options have been reset to default.")
 
+def render_export_options():
+    """Renders the encoding options for the downloaded timeline."""
+    with st.expander("Export Options", expanded=False):
+        export_format = st.selectbox("Export format", list(EXPORT_FORMATS), index=list(EXPORT_FORMATS).index(st.session_state["export_format"]))
+        st.session_state["export_format"] = export_format
+        if export_format != "JPEG":
+            compression_level = st.slider("Compression level", 0, 9, st.session_state["compression_level"])
+            st.session_state["compression_level"] = compression_level
+        if export_format == "WebP":
+            export_lossless = st.checkbox("Lossless", value=st.session_state["export_lossless"],
+                                          help="Sharper and often smaller, but compression level 9 can take over a second to encode.")
+            st.session_state["export_lossless"] = export_lossless
+        if export_format == "JPEG" or (export_format == "WebP" and not st.session_state["export_lossless"]):
+            export_quality = st.slider("Quality", 1, 100, st.session_state["export_quality"])
+            st.session_state["export_quality"] = export_quality
+        if export_format != "JPEG":
+            quantize = st.checkbox("Palette quantization", value=st.session_state["palette_colors"] > 0)
+            if quantize:
+                palette_colors = st.slider("Palette colors", 2, 256, st.session_state["palette_colors"] or 64)
+            else:
+                palette_colors = 0
+            st.session_state["palette_colors"] = palette_colors
+
 def reset_inputs():
     """Resets event input fields."""
     st.session_state["event_inputs"] = {
@@ -104,6 +158,8 @@ def reset_inputs():
         "starting_time": datetime.now().time(),
         "finishing_date": datetime.now().date(),
         "finishing_time": datetime.now().time(),
+        "repeat": "None",
+        "repeat_until": None,
     }
 
 def handle_event_addition():
@@ -115,11 +171,14 @@ def handle_event_addition():
         "event_title": inputs["event_title"],
         "place": inputs["place"],
         "starting_time": starting_datetime,
-        "finishing_time": finishing_datetime
+        "finishing_time": finishing_datetime,
+        "repeat": inputs["repeat"],
+        # Recurring events only store their rule; occurrences are expanded at render time
+        "repeat_until": datetime.combine(inputs["repeat_until"], time.max) if inputs["repeat"] != "None" and inputs["repeat_until"] else None
     }
-    st.session_state["events_df"] = pd.concat(
+    st.session_state["events_df"] = compact_events(pd.concat(
         [st.session_state["events_df"], pd.DataFrame([new_event])], ignore_index=True
-    )
+    ))
     reset_inputs()
     st.sidebar.success("Event added successfully!")
 
@@ -133,10 +192,10 @@ def handle_event_deletion():
     )
     if st.button("Delete Selected Event"):
         st.session_state["events_df"].drop(index=event_to_delete, inplace=True)
-        st.session_state["events_df"].reset_index(drop=True, inplace=True)
+        st.session_state["events_df"] = compact_events(st.session_state["events_df"].reset_index(drop=True))
         st.sidebar.success("Event deleted successfully!")
     if st.button("Delete All Events"):
-        st.session_state["events_df"] = pd.DataFrame(columns=events_df.columns)
+        st.session_state["events_df"] = compact_events(pd.DataFrame(columns=events_df.columns))
         st.success("All events deleted successfully!")
 
 def render_timeline():
@@ -144,8 +203,21 @@ def render_timeline():
     if st.session_state["events_df"].empty:
         st.warning("No events to display on the timeline.")
         return
-    fig = event_timeline(
+    window_start = st.session_state["window_start"]
+    window_end = st.session_state["window_end"]
+    events_df = expand_recurring_events(
         st.session_state["events_df"],
+        window_start=datetime.combine(window_start, time.min) if window_start else None,
+        window_end=datetime.combine(window_end, time.max) if window_end else None,
+    )
+    if events_df.empty:
+        if window_start or window_end:
+            st.warning("No events in the selected time window.")
+        else:
+            st.warning("The recurring events have no occurrences from today on. Set a custom time window under Styling Options to show earlier ones.")
+        return
+    background_image = st.session_state["background_image"]
+    style = dict(
         bar_color=st.session_state["bar_color"],
         bar_width=st.session_state["bar_width"],
         opacity=st.session_state["opacity"],
@@ -153,7 +225,7 @@ def render_timeline():
         height=st.session_state["height"],
         width=st.session_state["width"],
         background_color=st.session_state["background_color"],
-        background_image=st.session_state["background_image"],
+        background_image=encode_image(io.BytesIO(background_image)) if background_image else None,
         background_image_opacity=st.session_state["background_image_opacity"],
         grid_width=st.session_state["grid_width"],
         grid_color=st.session_state["grid_color"],
@@ -162,17 +234,35 @@ def render_timeline():
         time_letter_size=st.session_state["time_letter_size"],
         letter_style=st.session_state["letter_style"],
     )
-    buf = io.BytesIO()
-    fig.write_image(buf, format="png")
-    buf.seek(0)
+    if st.session_state["interactive_preview"]:
+        # WebGL only pays off in the browser, above the threshold
+        preview = event_timeline(events_df, webgl_threshold=st.session_state["webgl_threshold"], **style)
+        st.plotly_chart(preview, use_container_width=True)
+    # Kaleido rasterizes SVG bars faster than WebGL traces, so the export always uses SVG
+    fig = event_timeline(events_df, render_mode="svg", **style)
+    timeline_image = Image.open(io.BytesIO(fig.to_image(format="png")))
+    timeline_image.load()
+    export_format = st.session_state["export_format"]
+    # Encode the download in a worker thread while the mockup is being built
+    encoded_export = encode_export_async(
+        timeline_image,
+        export_format=export_format,
+        compression_level=st.session_state["compression_level"],
+        quality=st.session_state["export_quality"],
+        palette_colors=st.session_state["palette_colors"],
+        lossless=st.session_state["export_lossless"],
+    )
     mockup_type = st.selectbox("Select a mockup type", ["Story", "Square post", "Vertical post", "Horizontal post"])
-    mockup_image = simulate_instagram_display(Image.open(buf), mockup_type, st.session_state["width"], st.session_state["height"])
+    mockup_image = simulate_instagram_display(timeline_image, mockup_type, st.session_state["width"], st.session_state["height"])
     st.image(mockup_image, use_container_width=True)
+    export_data, encode_seconds = encoded_export.result()
+    extension, mime = EXPORT_FORMATS[export_format]
+    st.caption(f"{export_format}: {len(export_data) / 1024:.1f} KB, encoded in {encode_seconds * 1000:.0f} ms")
     st.download_button(
-        label="Download Mockup as PNG",
-        data=buf,
-        file_name=f"instagram_mockup_{mockup_type}.png",
-        mime="image/png"
+        label=f"Download Mockup as {export_format}",
+        data=export_data,
+        file_name=f"instagram_mockup_{mockup_type}.{extension}",
+        mime=mime
     )
 
 def main():
@@ -192,6 +282,10 @@ def main():
         inputs["starting_time"] = st.time_input("Starting Time", value=inputs["starting_time"])
         inputs["finishing_date"] = st.date_input("Finishing Date", value=inputs["finishing_date"])
         inputs["finishing_time"] = st.time_input("Finishing Time", value=inputs["finishing_time"])
+        repeat_options = ["None", *REPEAT_PERIODS]
+        inputs["repeat"] = st.selectbox("Repeat", repeat_options, index=repeat_options.index(inputs["repeat"]))
+        if inputs["repeat"] != "None":
+            inputs["repeat_until"] = st.date_input("Repeat Until (optional)", value=inputs["repeat_until"])
         
         if st.button("Add Event"):
             handle_event_addition()
@@ -208,6 +302,7 @@ def main():
         
     with right_col:
         render_styling_options()
+        render_export_options()
         
 
         
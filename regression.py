@@ -0,0 +1,498 @@
+import argparse
+import contextlib
+import importlib.metadata
+import io
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from PIL import Image, ImageCms
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.testing.v1 import AppTest
+from unittest import mock
+
+from functions import compact_events, expand_recurring_events
+
+# Golden-image and performance regression harness for main.py and dora.py.
+#
+#   python regression.py --update     record golden images and timing baselines
+#   python regression.py              compare against them, exit 1 on any drift
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(ROOT, "golden")
+BASELINE_FILE = os.path.join(GOLDEN_DIR, "baseline.json")
+OUTPUT_DIR = os.path.join(ROOT, "regression_output")
+
+APPS = {
+    "main": os.path.join(ROOT, "main.py"),
+    "dora": os.path.join(ROOT, "dora.py"),
+}
+
+# Default thresholds, all overridable from the command line
+MAX_MEAN_DELTA_E = 1.0  # mean CIE76 color difference over the image
+MAX_CHANGED_PIXELS = 0.005  # share of pixels whose color difference is noticeable
+NOTICEABLE_DELTA_E = 10.0
+MAX_LATENCY_DRIFT = 0.5  # allowed slowdown over the baseline, as a fraction
+LATENCY_SLACK = 0.25  # seconds on top of the drift, so sub-second scenarios don't flap
+MAX_MEMORY_DRIFT = 0.25  # allowed peak memory growth over the baseline, as a fraction
+MEMORY_SAMPLE_INTERVAL = 0.01  # seconds between samples of the render subprocess memory
+TIMING_RUNS = 3
+MEMORY_RUNS = 2  # the lowest peak is kept, Streamlit's background threads can allocate during a run
+APP_TIMEOUT = 120
+
+_lab_transform = ImageCms.buildTransform(
+    ImageCms.createProfile("sRGB"), ImageCms.createProfile("LAB"), "RGB", "LAB"
+)
+
+def small_dataset():
+    """A handful of one-off events over three days."""
+    day = datetime(2025, 3, 7)
+    rows = [
+        ("Opening", "Main Hall", 9, 11, 0),
+        ("Workshop", "Room A", 13, 17, 0),
+        ("Dinner", "Terrace", 19, 22, 0),
+        ("Talks", "Main Hall", 10, 16, 1),
+        ("Concert", "Park", 20, 23, 1),
+        ("Brunch", "Terrace", 10, 13, 2),
+        ("Closing", "Main Hall", 15, 17, 2),
+    ]
+    return pd.DataFrame([
+        {
+            "event_title": title,
+            "place": place,
+            "starting_time": day + timedelta(days=offset, hours=start),
+            "finishing_time": day + timedelta(days=offset, hours=finish),
+            "repeat": "None",
+            "repeat_until": None,
+        }
+        for title, place, start, finish, offset in rows
+    ])
+
+def recurring_dataset():
+    """Daily and weekly series next to a one-off event."""
+    day = datetime(2025, 3, 3)
+    return pd.DataFrame([
+        {"event_title": "Opening hours", "place": "Shop", "starting_time": day + timedelta(hours=9),
+         "finishing_time": day + timedelta(hours=18), "repeat": "Daily", "repeat_until": None},
+        {"event_title": "Yoga", "place": "Studio", "starting_time": day + timedelta(hours=7),
+         "finishing_time": day + timedelta(hours=8), "repeat": "Weekly",
+         "repeat_until": day + timedelta(days=60)},
+        {"event_title": "Launch", "place": "Shop", "starting_time": day + timedelta(days=2, hours=12),
+         "finishing_time": day + timedelta(days=2, hours=14), "repeat": "None", "repeat_until": None},
+    ])
+
+def large_dataset(n=6000):
+    """Many short events from a seeded generator, to catch slow renders."""
+    rng = np.random.default_rng(42)
+    starts = pd.Timestamp(2025, 3, 7) + pd.to_timedelta(rng.integers(0, 3 * 24 * 60, n), unit="min")
+    return pd.DataFrame({
+        "event_title": rng.choice([f"Session {i}" for i in range(8)], n),
+        "place": rng.choice(["Room A", "Room B", "Room C", "Main Hall"], n),
+        "starting_time": starts,
+        "finishing_time": starts + pd.to_timedelta(rng.integers(15, 120, n), unit="min"),
+        "repeat": "None",
+        "repeat_until": pd.NaT,
+    })
+
+DATASETS = {
+    "small": small_dataset,
+    "recurring": recurring_dataset,
+    "large": large_dataset,
+}
+
+# Session values each preset must leave in the session state when the app renders
+STYLE_PRESETS = {
+    "default": {},
+    "night": {
+        "bar_color": "#F2C14E",
+        "opacity": 0.9,
+        "bar_width": 0.4,
+        "background_color": "#1B2430",
+        "grid_width": 0.5,
+        "grid_color": "rgba(255, 255, 255, 0.3)",
+        "letter_color": "#FFFFFF",
+        "event_letter_size": 20,
+        "time_letter_size": 14,
+        "letter_style": "Courier New, monospace",
+        "visualize": "place",
+    },
+    # The rest only exist in main.py
+    "preview": {"interactive_preview": True},
+    "webp": {"export_format": "WebP", "export_lossless": False, "export_quality": 80, "palette_colors": 64},
+    "jpeg": {"export_format": "JPEG", "export_quality": 85},
+    "window": {"window_start": date(2025, 3, 8), "window_end": date(2025, 3, 14)},
+}
+
+SCENARIOS = {
+    f"{dataset}-{preset}": (dataset, preset)
+    for dataset in DATASETS
+    for preset in STYLE_PRESETS
+}
+
+# dora.py's styling widgets overwrite the session state on every run, so presets are applied
+# through them: session key -> (styling section or None if always shown, widget, label)
+DORA_WIDGETS = {
+    "bar_color": ("Bars", "color_picker", "Pick a color for bars"),
+    "opacity": ("Bars", "slider", "Bar opacity"),
+    "bar_width": ("Bars", "slider", "Bar width"),
+    "letter_color": ("Letters", "color_picker", "Pick a color for letters"),
+    "event_letter_size": ("Letters", "slider", "Letter size"),
+    "time_letter_size": ("Letters", "slider", "Time size"),
+    "letter_style": ("Letters", "selectbox", "Select a font family"),
+    "grid_width": ("Grid", "slider", "Grid width"),
+    "grid_color": ("Grid", "color_picker", "Pick a color for grid"),
+    "background_color": ("Background", "color_picker", "Pick a color for background"),
+    "visualize": (None, "selectbox", "Visualize events or place"),
+}
+
+def app_scenarios(app):
+    """Returns the scenarios an app can run; dora.py has no widgets for main.py-only presets."""
+    return [
+        scenario for scenario, (_, preset) in SCENARIOS.items()
+        if app == "main" or set(STYLE_PRESETS[preset]) <= set(DORA_WIDGETS)
+    ]
+
+def check_internals():
+    """
+    Fails early with a clear message when the private hooks the harness relies on are missing.
+    Both were checked on Streamlit 1.40.2 and 1.66 with plotly 5.24 and Kaleido 0.2.1.
+    """
+    if not hasattr(MemoryMediaFileStorage, "load_and_get_id"):
+        raise RuntimeError("Streamlit's MemoryMediaFileStorage.load_and_get_id is gone, so displayed "
+                           "images can't be read back; update run_app for this Streamlit version.")
+    kaleido_version = importlib.metadata.version("kaleido")
+    if not kaleido_version.startswith("0.2.") or not hasattr(getattr(pio.kaleido, "scope", None), "_shutdown_kaleido"):
+        raise RuntimeError(f"Measuring the render process restarts Kaleido through the private "
+                           f"plotly.io.kaleido.scope._shutdown_kaleido of Kaleido 0.2, but kaleido "
+                           f"{kaleido_version} is installed. Install kaleido==0.2.1.")
+
+def restart_kaleido():
+    """Shuts down Kaleido's renderer so the next export starts a fresh one."""
+    pio.kaleido.scope._shutdown_kaleido()
+
+def _widget(at, kind, label):
+    for widget in getattr(at, kind):
+        if widget.label == label:
+            return widget
+    raise RuntimeError(f"No {kind} labelled {label!r} in the app.")
+
+def apply_preset(at, app, preset):
+    """
+    Sets a style preset on an app that hasn't rendered its timeline yet, running it as needed.
+    Those setup runs render no events, so their exceptions are ignored.
+    """
+    values = STYLE_PRESETS[preset]
+    if app != "dora" or not values:
+        # main.py's widgets take their values from the session state
+        for key, value in values.items():
+            at.session_state[key] = value
+        return
+
+    logging.disable(logging.CRITICAL)  # dora.py logs a traceback when it renders no events
+    try:
+        _drive_widgets(at, values)
+    finally:
+        logging.disable(logging.NOTSET)
+
+def _drive_widgets(at, values):
+    at.run()
+    sections = {}
+    for key, value in values.items():
+        section, kind, label = DORA_WIDGETS[key]
+        sections.setdefault(section, []).append((key, kind, label, value))
+    for section, widgets in sections.items():
+        if section is not None:
+            _widget(at, "selectbox", "**Select**").set_value(section)
+            at.run()
+        for key, kind, label, value in widgets:
+            if key == "grid_color":
+                # The grid color is built from a picker and an opacity slider
+                red, green, blue, opacity = re.match(r"rgba\((\d+), (\d+), (\d+), ([\d.]+)\)", value).groups()
+                value = f"#{int(red):02X}{int(green):02X}{int(blue):02X}"
+                _widget(at, "slider", "Grid opacity").set_value(float(opacity))
+            _widget(at, kind, label).set_value(value)
+        at.run()
+
+def run_app(app, scenario, memory=None):
+    """
+    Runs one app headlessly for a scenario.
+
+    :param memory: Dict to record the run's peak memory into, see track_memory.
+
+    :return: Tuple of (outputs, run time in seconds). Outputs maps "timeline" to the displayed
+        mockup and "export" to the decoded download, both PIL Images, and "preview" to the
+        interactive chart's figure JSON when the app shows one.
+    """
+    dataset, preset = SCENARIOS[scenario]
+    values = STYLE_PRESETS[preset]
+    events_df = compact_events(DATASETS[dataset]())
+    at = AppTest.from_file(APPS[app], default_timeout=APP_TIMEOUT)
+    # Preset widgets are driven before any events exist: dora's event selectbox formats its
+    # options from st.session_state, which AppTest on Streamlit 1.40 can't evaluate between runs
+    apply_preset(at, app, preset)
+    at.session_state["events_df"] = events_df
+
+    # AppTest keeps media in a mock runtime that is gone after the run, so record it on the way
+    # in. Media ids are returned by load_and_get_id; checked on Streamlit 1.40.2 and 1.66.
+    media = {}
+    load_and_get_id = MemoryMediaFileStorage.load_and_get_id
+
+    def record_media(storage, path_or_data, *args, **kwargs):
+        file_id = load_and_get_id(storage, path_or_data, *args, **kwargs)
+        media[file_id] = storage.get_file(file_id).content
+        return file_id
+
+    tracker = track_memory(memory) if memory is not None else contextlib.nullcontext()
+    with mock.patch.object(MemoryMediaFileStorage, "load_and_get_id", record_media), tracker:
+        start = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - start
+
+    if at.exception:
+        raise RuntimeError(f"{app}/{scenario} raised: {at.exception[0].message}")
+    for key, value in values.items():
+        if at.session_state[key] != value:
+            raise RuntimeError(f"{app}/{scenario} rendered {key}={at.session_state[key]!r} instead of the preset {value!r}.")
+
+    def read_media(url, what):
+        file_id = os.path.splitext(url.rsplit("/", 1)[-1])[0]
+        if file_id not in media:
+            raise RuntimeError(f"Couldn't read back the {what}; Streamlit's media storage may have changed.")
+        image = Image.open(io.BytesIO(media[file_id]))
+        image.load()
+        return image
+
+    images = at.get("image") or at.get("imgs")  # "imgs" on Streamlit 1.40
+    downloads = at.get("download_button")
+    if not images or not downloads:
+        raise RuntimeError(f"{app}/{scenario} did not display a timeline and its download.")
+    outputs = {
+        "timeline": read_media(images[0].proto.imgs[0].url, "displayed image"),
+        "export": read_media(downloads[0].proto.url, "download"),
+    }
+    export_format = values.get("export_format", "PNG")
+    if outputs["export"].format != export_format.upper():
+        raise RuntimeError(f"{app}/{scenario} exported {outputs['export'].format} instead of {export_format}.")
+
+    charts = at.get("plotly_chart")
+    if values.get("interactive_preview"):
+        if not charts:
+            raise RuntimeError(f"{app}/{scenario} did not display the interactive preview.")
+        # The preview switches to WebGL above the threshold, counting the expanded occurrences
+        trace_types = {trace["type"] for trace in json.loads(charts[0].proto.spec)["data"]}
+        expected = "scattergl" if len(expand_recurring_events(events_df)) > at.session_state["webgl_threshold"] else "bar"
+        if trace_types != {expected}:
+            raise RuntimeError(f"{app}/{scenario} previewed {sorted(trace_types)} traces instead of {expected}.")
+        outputs["preview"] = charts[0].proto.spec
+    elif charts:
+        raise RuntimeError(f"{app}/{scenario} displayed an interactive preview it wasn't asked for.")
+    return outputs, elapsed
+
+def _descendants_rss():
+    """
+    Returns the summed resident memory in bytes of this process's descendants, which includes
+    Kaleido's Chromium renderer. Returns None where /proc isn't available.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:  # the process exited meanwhile
+            continue
+        processes[int(entry)] = (int(fields[1]), int(fields[21]))  # parent pid, rss in pages
+    children = {}
+    for pid, (parent, _) in processes.items():
+        children.setdefault(parent, []).append(pid)
+    total, pending = 0, list(children.get(os.getpid(), []))
+    while pending:
+        pid = pending.pop()
+        total += processes[pid][1]
+        pending.extend(children.get(pid, []))
+    return total * os.sysconf("SC_PAGE_SIZE")
+
+@contextlib.contextmanager
+def track_memory(memory):
+    """
+    Records the peak Python heap and the peak resident memory of the render subprocess while
+    the block runs, in MB, into memory["python_heap_mb"] and memory["render_rss_mb"] (None
+    where it can't be read).
+    """
+    rss_peak = _descendants_rss()
+    stop_sampling = threading.Event()
+
+    def sample_rss():
+        nonlocal rss_peak
+        while not stop_sampling.wait(MEMORY_SAMPLE_INTERVAL):
+            rss_peak = max(rss_peak, _descendants_rss())
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    if rss_peak is not None:
+        sampler.start()
+    tracemalloc.start()
+    try:
+        yield
+        _, heap_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        stop_sampling.set()
+        if sampler.is_alive():
+            sampler.join()
+    memory["python_heap_mb"] = heap_peak / 2**20
+    memory["render_rss_mb"] = rss_peak / 2**20 if rss_peak is not None else None
+
+def measure(app, scenario, runs=TIMING_RUNS):
+    """
+    Renders a scenario several times.
+
+    :return: Tuple of (images by output name, median latency in seconds, peak Python heap in
+        MB, peak render subprocess resident memory in MB or None where it can't be read).
+    """
+    latencies = []
+    for _ in range(runs):
+        outputs, elapsed = run_app(app, scenario)
+        latencies.append(elapsed)
+    images = {name: output for name, output in outputs.items() if name != "preview"}
+    if "preview" in outputs:
+        # Rasterize the interactive chart as the browser would draw it, WebGL traces included
+        images["preview"] = Image.open(io.BytesIO(pio.from_json(outputs["preview"]).to_image(format="png")))
+        images["preview"].load()
+
+    # Measured in separate runs, tracemalloc and the sampler slow them down. Kaleido's renderer
+    # keeps the memory of earlier scenarios, so it is restarted to measure this one alone.
+    usages = []
+    for _ in range(MEMORY_RUNS):
+        restart_kaleido()
+        usages.append({})
+        run_app(app, scenario, memory=usages[-1])
+    heap_mb = min(usage["python_heap_mb"] for usage in usages)
+    render_mb = None if usages[0]["render_rss_mb"] is None else min(usage["render_rss_mb"] for usage in usages)
+    return images, statistics.median(latencies), heap_mb, render_mb
+
+def perceptual_difference(image, golden):
+    """
+    Compares two images in CIELAB space.
+
+    :return: Tuple of (mean CIE76 color difference, share of pixels above NOTICEABLE_DELTA_E),
+        or None when the sizes differ.
+    """
+    if image.size != golden.size:
+        return None
+    lab_image, lab_golden = (
+        np.asarray(ImageCms.applyTransform(im.convert("RGB"), _lab_transform), dtype=np.float64)
+        for im in (image, golden)
+    )
+    # Pillow stores L in 0-255 and a/b offset by 128
+    scale = np.array([100 / 255, 1.0, 1.0])
+    delta_e = np.linalg.norm((lab_image - lab_golden) * scale, axis=-1)
+    return delta_e.mean(), (delta_e > NOTICEABLE_DELTA_E).mean()
+
+def golden_path(app, scenario, output="timeline"):
+    name = scenario if output == "timeline" else f"{scenario}-{output}"
+    return os.path.join(GOLDEN_DIR, app, f"{name}.png")
+
+def load_baseline():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE) as baseline_file:
+        return json.load(baseline_file)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Golden-image and performance regression checks for main.py and dora.py.")
+    parser.add_argument("--update", action="store_true", help="record golden images and baselines instead of comparing")
+    parser.add_argument("--app", choices=list(APPS), action="append", help="app to check (default: all)")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), action="append", help="scenario to check (default: all)")
+    parser.add_argument("--runs", type=int, default=TIMING_RUNS, help="timed runs per scenario")
+    parser.add_argument("--max-mean-delta-e", type=float, default=MAX_MEAN_DELTA_E)
+    parser.add_argument("--max-changed-pixels", type=float, default=MAX_CHANGED_PIXELS)
+    parser.add_argument("--max-latency-drift", type=float, default=MAX_LATENCY_DRIFT)
+    parser.add_argument("--latency-slack", type=float, default=LATENCY_SLACK)
+    parser.add_argument("--max-memory-drift", type=float, default=MAX_MEMORY_DRIFT)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    check_internals()
+    baseline = load_baseline()
+    failures = []
+
+    apps = args.app or list(APPS)
+    scenarios = {
+        app: [scenario for scenario in args.scenario or list(SCENARIOS) if scenario in app_scenarios(app)]
+        for app in apps
+    }
+    # Pay for Kaleido's first start and each app's imports outside the timed runs
+    for app in apps:
+        if scenarios[app]:
+            run_app(app, scenarios[app][0])
+
+    for app in apps:
+        for scenario in scenarios[app]:
+            name = f"{app}/{scenario}"
+            images, latency, heap_mb, render_mb = measure(app, scenario, args.runs)
+            render_text = f"{render_mb:.1f} MB" if render_mb is not None else "n/a"
+            print(f"{name}: {latency * 1000:.0f} ms, Python heap {heap_mb:.1f} MB, render process {render_text}")
+
+            if args.update:
+                for output, image in images.items():
+                    os.makedirs(os.path.dirname(golden_path(app, scenario, output)), exist_ok=True)
+                    image.save(golden_path(app, scenario, output))
+                baseline[name] = {"latency_s": latency, "python_heap_mb": heap_mb, "render_rss_mb": render_mb}
+                continue
+
+            if name not in baseline or not all(os.path.exists(golden_path(app, scenario, output)) for output in images):
+                failures.append(f"{name}: no golden image or baseline, run with --update")
+                continue
+
+            for output, image in images.items():
+                difference = perceptual_difference(image, Image.open(golden_path(app, scenario, output)))
+                image_failure = None
+                if difference is None:
+                    image_failure = f"{name}: {output} image size changed"
+                else:
+                    mean_delta_e, changed_pixels = difference
+                    if mean_delta_e > args.max_mean_delta_e or changed_pixels > args.max_changed_pixels:
+                        image_failure = f"{name}: {output} image drifted (mean dE {mean_delta_e:.2f}, {changed_pixels:.2%} pixels changed)"
+                if image_failure:
+                    failures.append(image_failure)
+                    # Keep the offending render for inspection
+                    output_path = golden_path(app, scenario, output).replace(GOLDEN_DIR, OUTPUT_DIR, 1)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    image.save(output_path)
+
+            expected = baseline[name]
+            if latency > expected["latency_s"] * (1 + args.max_latency_drift) + args.latency_slack:
+                failures.append(f"{name}: latency {latency * 1000:.0f} ms over baseline {expected['latency_s'] * 1000:.0f} ms")
+            if heap_mb > expected["python_heap_mb"] * (1 + args.max_memory_drift):
+                failures.append(f"{name}: Python heap {heap_mb:.1f} MB over baseline {expected['python_heap_mb']:.1f} MB")
+            if render_mb is not None and expected.get("render_rss_mb") is not None \
+                    and render_mb > expected["render_rss_mb"] * (1 + args.max_memory_drift):
+                failures.append(f"{name}: render process {render_mb:.1f} MB over baseline {expected['render_rss_mb']:.1f} MB")
+
+    if args.update:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(BASELINE_FILE, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print(f"Recorded golden images and baselines in {GOLDEN_DIR}")
+        return 0
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())